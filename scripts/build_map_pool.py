@@ -1,6 +1,8 @@
 import argparse
+import json
 import os
 import sys
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -10,22 +12,7 @@ except ModuleNotFoundError:
     import map_pool
 
 
-def run(config_dir, dist_dir, env, bootstrap, excel_path, history_path="history/versions.json"):
-    config_dir = Path(config_dir)
-    dist_dir = Path(dist_dir)
-
-    map_map = map_pool.load_map_name_map(config_dir / "map-name-map.json")
-
-    if bootstrap:
-        if not excel_path:
-            raise ValueError("bootstrap requires excel_path")
-        base_pool = map_pool.read_current_pool_from_excel(excel_path)
-        map_pool.write_current_pool(config_dir / "current_pool.json", base_pool)
-        source = "bootstrap"
-    else:
-        base_pool = map_pool.load_current_pool(config_dir / "current_pool.json")
-        source = "rolling"
-
+def compute_build(map_map, base_pool, env, source):
     returning = map_pool.normalize_list(map_pool.parse_list(env.get("RETURNING", "")))
     adding = map_pool.normalize_list(map_pool.parse_list(env.get("ADDING", "")))
     rotated_out = map_pool.normalize_list(map_pool.parse_list(env.get("ROTATED_OUT", "")))
@@ -62,23 +49,378 @@ def run(config_dir, dist_dir, env, bootstrap, excel_path, history_path="history/
         warnings=warnings,
         generated_at=datetime.now(timezone.utc).isoformat(),
     )
+    return {
+        "version": version,
+        "version_date": version_date,
+        "current_pool": current_pool,
+        "maps": maps_payload,
+        "meta": meta_payload,
+    }
+
+
+def write_build(
+    config_dir,
+    dist_dir,
+    history_path,
+    build,
+    entries,
+    map_map=None,
+    compact=False,
+    dry_run=False,
+    history_db_path=None,
+    map_index_path=None,
+    refresh_names=False,
+):
+    # refresh_names keeps the DB map names and the persisted index in step
+    # with map-name-map.json even when the pool and history are left alone.
+    persist_derived = not dry_run or refresh_names
+    if build["version"]:
+        entries = map_pool.upsert_history_entry(
+            entries, build["version"], build["version_date"], build["current_pool"]
+        )
+    # Encode before anything is written so a failure leaves no partial build.
+    compact_payload = None
+    if compact:
+        compact_payload = map_pool.encode_compact(
+            map_map,
+            build["maps"],
+            entries,
+            version=build["version"],
+            version_date=build["version_date"],
+        )
+
+    index = None
+    if map_index_path and build["version"]:
+        index = map_pool.load_membership_index(map_index_path)
+        if map_pool.membership_index_is_current(index, entries, build["version"]):
+            changed = map_pool.update_membership_index(
+                index,
+                map_map,
+                build["current_pool"],
+                build["version"],
+                build["version_date"],
+            )
+        else:
+            index = map_pool.build_membership_index(entries, map_map)
+            changed = set(index["maps"])
+
+    map_pool.write_outputs(dist_dir, build["maps"], build["meta"], version=build["version"])
+    if compact_payload is not None:
+        map_pool.write_compact_outputs(dist_dir, compact_payload, version=build["version"])
+    if not dry_run:
+        map_pool.write_current_pool(Path(config_dir) / "current_pool.json", build["current_pool"])
+        if build["version"]:
+            map_pool.write_history(history_path, entries)
+    if persist_derived and build["version"] and history_db_path:
+        map_pool.update_history_db(history_db_path, map_map, entries)
+    if index is not None:
+        if persist_derived:
+            map_pool.write_membership_index(map_index_path, index)
+        map_pool.write_map_index_outputs(dist_dir, index, changed)
+    return entries
+
+
+def run(
+    config_dir,
+    dist_dir,
+    env,
+    bootstrap,
+    excel_path,
+    history_path="history/versions.json",
+    compact=False,
+    dry_run=False,
+    on_conflict="rebase",
+    history_db_path=None,
+    map_index_path=None,
+    snapshot_path=None,
+    timings=None,
+):
+    if on_conflict not in ("rebase", "fail"):
+        raise ValueError(f"invalid on_conflict: {on_conflict}")
+    config_dir = Path(config_dir)
+    dist_dir = Path(dist_dir)
+    pool_path = config_dir / "current_pool.json"
+    started = time.perf_counter()
+    snapshot = "off"
+
+    if bootstrap:
+        if not excel_path:
+            raise ValueError("bootstrap requires excel_path")
+        map_map = map_pool.load_map_name_map(config_dir / "map-name-map.json")
+        base_pool = map_pool.read_current_pool_from_excel(excel_path)
+        source = "bootstrap"
+        pool_digest = map_pool.file_digest(pool_path)
+        entries, history_digest = map_pool.load_json_with_digest(history_path, default=[])
+    elif snapshot_path:
+        values, digests, hit = map_pool.load_json_snapshot(
+            snapshot_path,
+            {
+                "map_map": config_dir / "map-name-map.json",
+                "base_pool": pool_path,
+                "entries": history_path,
+            },
+            defaults={"entries": []},
+        )
+        map_map = values["map_map"]
+        base_pool = values["base_pool"]
+        entries = values["entries"]
+        pool_digest = digests["base_pool"]
+        history_digest = digests["entries"]
+        source = "rolling"
+        snapshot = "hit" if hit else "miss"
+    else:
+        map_map = map_pool.load_map_name_map(config_dir / "map-name-map.json")
+        # Hash the same bytes that are parsed so the digest matches the pool.
+        base_pool, pool_digest = map_pool.load_json_with_digest(pool_path)
+        entries, history_digest = map_pool.load_json_with_digest(history_path, default=[])
+        source = "rolling"
+    if timings is not None:
+        timings["config_ms"] = (time.perf_counter() - started) * 1000
+        timings["snapshot"] = snapshot
+
+    build = compute_build(map_map, base_pool, env, source)
+    if dry_run:
+        write_build(
+            config_dir,
+            dist_dir,
+            history_path,
+            build,
+            entries,
+            map_map,
+            compact,
+            dry_run=True,
+            map_index_path=map_index_path,
+        )
+        return
+
+    with map_pool.file_lock(config_dir / ".build.lock"):
+        if map_pool.file_digest(pool_path) != pool_digest:
+            if on_conflict == "fail" or bootstrap:
+                raise ValueError("base pool changed during build; rerun against the new pool")
+            base_pool = map_pool.load_current_pool(pool_path)
+            try:
+                build = compute_build(map_map, base_pool, env, source)
+            except ValueError as exc:
+                raise ValueError(
+                    f"base pool changed during build; changeset no longer applies: {exc}"
+                ) from exc
+        if map_pool.file_digest(history_path) != history_digest:
+            if on_conflict == "fail":
+                raise ValueError("history changed during build; rerun against the new history")
+            entries = map_pool.load_history(history_path)
+        write_build(
+            config_dir,
+            dist_dir,
+            history_path,
+            build,
+            entries,
+            map_map,
+            compact,
+            history_db_path=history_db_path,
+            map_index_path=map_index_path,
+        )
+
+
+def load_changeset(path):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    changeset = json.loads(path.read_text(encoding="utf-8"))
+    if not isinstance(changeset, dict):
+        raise ValueError("changeset must be a JSON object")
+    return {key: str(value) for key, value in changeset.items()}
+
+
+def _file_signature(path):
+    try:
+        stat = Path(path).stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _config_signatures(config_dir):
+    config_dir = Path(config_dir)
+    if not config_dir.is_dir():
+        return {}
+    return {p.name: _file_signature(p) for p in sorted(config_dir.iterdir()) if p.is_file()}
+
+
+def watch(
+    config_dir,
+    dist_dir,
+    env,
+    changeset_path=None,
+    history_path="history/versions.json",
+    compact=False,
+    history_db_path=None,
+    map_index_path=None,
+    dry_run=False,
+    interval=0.5,
+    max_cycles=None,
+    sleep=time.sleep,
+    log=print,
+):
+    config_dir = Path(config_dir)
+    pool_path = config_dir / "current_pool.json"
+    loaders = {
+        "map_map": lambda: map_pool.load_map_name_map(config_dir / "map-name-map.json"),
+        "base_pool": lambda: map_pool.load_current_pool(pool_path),
+        "env": lambda: {**env, **load_changeset(changeset_path)} if changeset_path else env,
+        "entries": lambda: map_pool.load_history(history_path),
+    }
+    digest_paths = {"base_pool": pool_path, "entries": Path(history_path)}
+    state = {}
+    digests = {}
+    pending = set(loaders)
+    seen = None
+    retry = False
+    cycles = 0
+
+    def signatures():
+        return {
+            "config": _config_signatures(config_dir),
+            "changeset": _file_signature(changeset_path) if changeset_path else None,
+            "history": _file_signature(history_path),
+        }
 
-    map_pool.write_outputs(dist_dir, maps_payload, meta_payload, version=version)
-    map_pool.write_current_pool(config_dir / "current_pool.json", current_pool)
-    if version:
-        entries = map_pool.load_history(history_path)
-        entries = map_pool.upsert_history_entry(entries, version, version_date, current_pool)
-        map_pool.write_history(history_path, entries)
+    while True:
+        current = signatures()
+        changed = seen is None or retry
+        retry = False
+        if seen is not None and current != seen:
+            old_config, new_config = seen["config"], current["config"]
+            if old_config.get("map-name-map.json") != new_config.get("map-name-map.json"):
+                pending.add("map_map")
+            if seen["changeset"] != current["changeset"]:
+                pending.add("env")
+            # Our own writes also move the signatures; only a content change
+            # from someone else reloads the pool or history.
+            for key, path in digest_paths.items():
+                if map_pool.file_digest(path) != digests.get(key):
+                    pending.add(key)
+            changed = changed or bool(pending)
+
+        if changed:
+            started = time.perf_counter()
+            try:
+                for key in list(pending):
+                    if key in digest_paths:
+                        digests[key] = map_pool.file_digest(digest_paths[key])
+                    state[key] = loaders[key]()
+                    if key == "base_pool":
+                        state["written_pool"] = state["base_pool"]
+                    if key == "map_map":
+                        state["names_dirty"] = True
+                    pending.discard(key)
+                build = compute_build(state["map_map"], state["base_pool"], state["env"], "rolling")
+                # Only touch the pool and history when this rebuild changes
+                # them; a renamed map only refreshes the DB names and index.
+                persist = not dry_run and (
+                    build["current_pool"] != state.get("written_pool")
+                    or map_pool.upsert_history_entry(
+                        state["entries"],
+                        build["version"],
+                        build["version_date"],
+                        build["current_pool"],
+                    )
+                    != state["entries"]
+                )
+                with map_pool.file_lock(config_dir / ".build.lock"):
+                    stale = [
+                        key
+                        for key, path in digest_paths.items()
+                        if map_pool.file_digest(path) != digests[key]
+                    ]
+                    if stale:
+                        pending.update(stale)
+                        retry = True
+                        names = ", ".join(digest_paths[key].name for key in stale)
+                        raise ValueError(f"{names} changed during rebuild; reloading")
+                    state["entries"] = write_build(
+                        config_dir,
+                        dist_dir,
+                        history_path,
+                        build,
+                        state["entries"],
+                        state["map_map"],
+                        compact,
+                        dry_run=not persist,
+                        history_db_path=history_db_path,
+                        map_index_path=map_index_path,
+                        refresh_names=state["names_dirty"] and not dry_run,
+                    )
+                    if persist:
+                        for key, path in digest_paths.items():
+                            digests[key] = map_pool.file_digest(path)
+                if persist:
+                    state["written_pool"] = build["current_pool"]
+                    stages = "all stages"
+                elif state["names_dirty"] and not dry_run:
+                    stages = "dist and map names"
+                else:
+                    stages = "dist only"
+                state["names_dirty"] = False
+                elapsed = (time.perf_counter() - started) * 1000
+                log(f"rebuilt {build['version']} ({stages}) in {elapsed:.1f} ms")
+            except (ValueError, OSError) as exc:
+                log(f"ERROR: {exc}")
+        seen = current
+
+        cycles += 1
+        if max_cycles is not None and cycles >= max_cycles:
+            return
+        sleep(interval)
 
 
 def main(argv=None):
+    # CPU time so far covers interpreter start-up and imports.
+    startup_ms = time.process_time() * 1000
+    started = time.perf_counter()
     parser = argparse.ArgumentParser()
     parser.add_argument("--config-dir", default="config")
     parser.add_argument("--dist-dir", default="dist")
     parser.add_argument("--bootstrap", action="store_true")
     parser.add_argument("--excel-path", default="地图轮换.xlsx")
+    parser.add_argument("--compact", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--history-db", default=None)
+    parser.add_argument("--map-index", default=None)
+    parser.add_argument("--on-conflict", choices=["rebase", "fail"], default=None)
+    parser.add_argument("--watch", action="store_true")
+    parser.add_argument("--changeset", default=None)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--snapshot", default=None)
+    parser.add_argument("--timings", action="store_true")
     args = parser.parse_args(argv)
 
+    if args.watch:
+        if args.bootstrap:
+            print("ERROR: --watch cannot be combined with --bootstrap", file=sys.stderr)
+            sys.exit(1)
+        if args.on_conflict == "fail":
+            print(
+                "ERROR: --watch always rebases on conflict; drop --on-conflict fail",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        try:
+            watch(
+                config_dir=args.config_dir,
+                dist_dir=args.dist_dir,
+                env=dict(os.environ),
+                changeset_path=args.changeset,
+                compact=args.compact,
+                history_db_path=args.history_db,
+                map_index_path=args.map_index,
+                dry_run=args.dry_run,
+                interval=args.interval,
+            )
+        except KeyboardInterrupt:
+            pass
+        return
+
+    timings = {}
     try:
         run(
         config_dir=args.config_dir,
@@ -86,10 +428,25 @@ def main(argv=None):
         env=os.environ,
         bootstrap=args.bootstrap,
         excel_path=args.excel_path,
+        compact=args.compact,
+        dry_run=args.dry_run,
+        on_conflict=args.on_conflict or "rebase",
+        history_db_path=args.history_db,
+        map_index_path=args.map_index,
+        snapshot_path=args.snapshot or None,
+        timings=timings,
     )
     except ValueError as exc:
         print(f"ERROR: {exc}", file=sys.stderr)
         sys.exit(1)
+    if args.timings:
+        total_ms = (time.perf_counter() - started) * 1000
+        print(
+            f"startup: {startup_ms:.1f} ms cpu before main, "
+            f"config {timings['config_ms']:.1f} ms (snapshot {timings['snapshot']}), "
+            f"run {total_ms:.1f} ms",
+            file=sys.stderr,
+        )
 
 
 if __name__ == "__main__":
@@ -1,11 +1,25 @@
+import hashlib
+import heapq
+import itertools
 import json
+import marshal
+import os
 import re
+import struct
+from contextlib import contextmanager
 from datetime import date
-import zipfile
-import xml.etree.ElementTree as ET
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: same-host locking is best effort
+    fcntl = None
+
 _SEP_PATTERN = re.compile(r"[、,， ]+")
+STATUS_CODES = ("in_pool", "returning", "add", "rotated_out")
+COMPACT_FORMAT = 1
+_COMPACT_MAGIC = b"VMP"
+_COMPACT_MAX_MAPS = 32
 
 
 def parse_list(raw):
@@ -152,7 +166,107 @@ def load_current_pool(path):
 
 
 def write_current_pool(path, pool):
-    Path(path).write_text(json.dumps(pool, ensure_ascii=False, indent=2), encoding="utf-8")
+    _write_text_atomic(path, json.dumps(pool, ensure_ascii=False, indent=2))
+
+
+def _write_text_atomic(path, text):
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def file_digest(path):
+    path = Path(path)
+    if not path.exists():
+        return ""
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def load_json_with_digest(path, default=None):
+    path = Path(path)
+    if default is not None and not path.exists():
+        return default, ""
+    raw = path.read_bytes()
+    return json.loads(raw.decode("utf-8")), hashlib.sha256(raw).hexdigest()
+
+
+def _source_stat(path):
+    try:
+        stat = Path(path).stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_json_snapshot(snapshot_path, sources, defaults=None):
+    defaults = defaults or {}
+    snapshot_path = Path(snapshot_path)
+    try:
+        cached = marshal.loads(snapshot_path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        cached = {}
+    if not isinstance(cached, dict):
+        cached = {}
+    resolved = {key: str(Path(path).resolve()) for key, path in sources.items()}
+    # Keep only the current sources so the snapshot cannot grow without bound.
+    kept = {source: cached[source] for source in resolved.values() if source in cached}
+    dirty = len(kept) != len(cached)
+    cached = kept
+
+    values = {}
+    digests = {}
+    hits = 0
+    for key, path in sources.items():
+        source = resolved[key]
+        stat = _source_stat(path)
+        record = cached.get(source)
+        if stat is None:
+            if key not in defaults:
+                raise FileNotFoundError(f"missing config file: {path}")
+            values[key] = defaults[key]
+            digests[key] = ""
+            hits += 1
+            continue
+        if record and record["stat"] == stat:
+            hits += 1
+        else:
+            raw = Path(path).read_bytes()
+            digest = hashlib.sha256(raw).hexdigest()
+            if record and record["sha256"] == digest:
+                hits += 1
+                record["stat"] = stat
+            else:
+                record = {
+                    "stat": stat,
+                    "sha256": digest,
+                    "value": json.loads(raw.decode("utf-8")),
+                }
+            cached[source] = record
+            dirty = True
+        values[key] = record["value"]
+        digests[key] = record["sha256"]
+
+    if dirty:
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = snapshot_path.with_name(f".{snapshot_path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(marshal.dumps(cached))
+        os.replace(tmp, snapshot_path)
+    return values, digests, hits == len(sources)
+
+
+@contextmanager
+def file_lock(path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
 
 
 def write_outputs(dist_dir, maps_payload, meta_payload, version=""):
@@ -185,7 +299,7 @@ def load_history(path):
 def write_history(path, entries):
     path = Path(path)
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+    _write_text_atomic(path, json.dumps(entries, ensure_ascii=False, indent=2))
 
 
 def upsert_history_entry(entries, version, version_date, current_pool):
@@ -214,6 +328,510 @@ def upsert_history_entry(entries, version, version_date, current_pool):
     return updated
 
 
+def build_map_bits(map_map):
+    return {name_zh: 1 << i for i, name_zh in enumerate(map_map)}
+
+
+def pool_to_mask(pool, bits):
+    missing = [m for m in pool if m not in bits]
+    if missing:
+        raise ValueError(f"unknown maps: {sorted(missing)}")
+    mask = 0
+    for name_zh in pool:
+        mask |= bits[name_zh]
+    return mask
+
+
+def mask_to_pool(mask, bits):
+    return [name_zh for name_zh, bit in bits.items() if mask & bit]
+
+
+def history_streaks(entries, map_map):
+    in_streak = {name_zh: 0 for name_zh in map_map}
+    out_streak = {name_zh: 0 for name_zh in map_map}
+    for entry in entries:
+        pool = set(entry.get("current_pool", []))
+        for name_zh in map_map:
+            if name_zh in pool:
+                in_streak[name_zh] += 1
+                out_streak[name_zh] = 0
+            else:
+                in_streak[name_zh] = 0
+                out_streak[name_zh] += 1
+    return in_streak, out_streak
+
+
+def simulate_rotations(
+    base_pool,
+    map_map,
+    entries,
+    out_count,
+    return_count=None,
+    max_size=7,
+    keep=(),
+    exclude=(),
+    top=None,
+):
+    if return_count is None:
+        return_count = out_count
+    missing = {m for m in [*base_pool, *keep, *exclude] if m not in map_map}
+    if missing:
+        raise ValueError(f"unknown maps: {sorted(missing)}")
+
+    bits = build_map_bits(map_map)
+    base_mask = pool_to_mask(base_pool, bits)
+    size = bin(base_mask).count("1") - out_count + return_count
+    if size <= 0 or size > max_size:
+        return []
+
+    out_mask = base_mask & ~pool_to_mask(keep, bits)
+    return_mask = ~base_mask & ~pool_to_mask(exclude, bits)
+    out_names = [m for m in base_pool if bits[m] & out_mask]
+    return_names = [m for m in map_map if bits[m] & return_mask]
+
+    in_streak, out_streak = history_streaks(entries, map_map)
+    out_options = [
+        (sum(in_streak[m] for m in combo), combo)
+        for combo in itertools.combinations(out_names, out_count)
+    ]
+    return_options = [
+        (sum(out_streak[m] for m in combo), combo)
+        for combo in itertools.combinations(return_names, return_count)
+    ]
+
+    scored = (
+        (out_score + return_score, out_combo, return_combo)
+        for out_score, out_combo in out_options
+        for return_score, return_combo in return_options
+    )
+    if top is None:
+        ranked = sorted(scored, key=lambda c: c[0], reverse=True)
+    else:
+        ranked = heapq.nlargest(top, scored, key=lambda c: c[0])
+
+    out = []
+    for score, out_combo, return_combo in ranked:
+        rotated_out = list(out_combo)
+        returning = list(return_combo)
+        out.append({
+            "score": score,
+            "rotated_out": rotated_out,
+            "returning": returning,
+            "current_pool": compute_current_pool(base_pool, returning, [], rotated_out),
+        })
+    return out
+
+
+def encode_compact(map_map, maps_payload, entries, version="", version_date=""):
+    if len(map_map) > _COMPACT_MAX_MAPS:
+        raise ValueError(f"compact format supports at most {_COMPACT_MAX_MAPS} maps")
+    index = {name_zh: i for i, name_zh in enumerate(map_map)}
+    bits = build_map_bits(map_map)
+    return {
+        "format": COMPACT_FORMAT,
+        "names": [[name_zh, name_en] for name_zh, name_en in map_map.items()],
+        "version": version,
+        "version_date": version_date,
+        "maps": [
+            [index[m["name_zh"]], STATUS_CODES.index(m["status"])]
+            for m in maps_payload["maps"]
+        ],
+        "history": [
+            [e["version"], e["version_date"], pool_to_mask(e["current_pool"], bits)]
+            for e in entries
+        ],
+    }
+
+
+def decode_compact(compact):
+    if compact.get("format") != COMPACT_FORMAT:
+        raise ValueError(f"unsupported compact format: {compact.get('format')}")
+    names = compact["names"]
+    bits = {name_zh: 1 << i for i, (name_zh, _) in enumerate(names)}
+    return {
+        "version": compact["version"],
+        "version_date": compact["version_date"],
+        "maps": [
+            {
+                "name_zh": names[idx][0],
+                "name_en": names[idx][1],
+                "status": STATUS_CODES[code],
+            }
+            for idx, code in compact["maps"]
+        ],
+        "history": [
+            {
+                "version": version,
+                "version_date": version_date,
+                "current_pool": mask_to_pool(mask, bits),
+            }
+            for version, version_date, mask in compact["history"]
+        ],
+    }
+
+
+def dumps_compact_json(compact):
+    return json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
+
+def _pack_str(value):
+    raw = value.encode("utf-8")
+    return struct.pack("<H", len(raw)) + raw
+
+
+def _unpack_str(data, offset):
+    (length,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    return data[offset : offset + length].decode("utf-8"), offset + length
+
+
+def _date_to_ordinal(value):
+    return date.fromisoformat(value).toordinal() if value else 0
+
+
+def _ordinal_to_date(value):
+    return date.fromordinal(value).isoformat() if value else ""
+
+
+def pack_compact(compact):
+    out = [_COMPACT_MAGIC, struct.pack("<BB", compact["format"], len(compact["names"]))]
+    for name_zh, name_en in compact["names"]:
+        out.append(_pack_str(name_zh))
+        out.append(_pack_str(name_en))
+    out.append(_pack_str(compact["version"]))
+    out.append(struct.pack("<IB", _date_to_ordinal(compact["version_date"]), len(compact["maps"])))
+    for idx, code in compact["maps"]:
+        out.append(struct.pack("<BB", idx, code))
+    out.append(struct.pack("<H", len(compact["history"])))
+    for version, version_date, mask in compact["history"]:
+        out.append(_pack_str(version))
+        out.append(struct.pack("<II", _date_to_ordinal(version_date), mask))
+    return b"".join(out)
+
+
+def unpack_compact(data):
+    if data[:3] != _COMPACT_MAGIC:
+        raise ValueError("not a compact map pool payload")
+    fmt, name_count = struct.unpack_from("<BB", data, 3)
+    if fmt != COMPACT_FORMAT:
+        raise ValueError(f"unsupported compact format: {fmt}")
+    offset = 5
+    names = []
+    for _ in range(name_count):
+        name_zh, offset = _unpack_str(data, offset)
+        name_en, offset = _unpack_str(data, offset)
+        names.append([name_zh, name_en])
+    version, offset = _unpack_str(data, offset)
+    version_ordinal, map_count = struct.unpack_from("<IB", data, offset)
+    offset += 5
+    maps = []
+    for _ in range(map_count):
+        idx, code = struct.unpack_from("<BB", data, offset)
+        offset += 2
+        maps.append([idx, code])
+    (history_count,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    history = []
+    for _ in range(history_count):
+        entry_version, offset = _unpack_str(data, offset)
+        entry_ordinal, mask = struct.unpack_from("<II", data, offset)
+        offset += 8
+        history.append([entry_version, _ordinal_to_date(entry_ordinal), mask])
+    return {
+        "format": fmt,
+        "names": names,
+        "version": version,
+        "version_date": _ordinal_to_date(version_ordinal),
+        "maps": maps,
+        "history": history,
+    }
+
+
+def write_compact_outputs(dist_dir, compact, version=""):
+    dirs = [Path(dist_dir)]
+    if version:
+        dirs.append(Path(dist_dir) / version)
+    for out_dir in dirs:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        (out_dir / "compact.json").write_text(dumps_compact_json(compact), encoding="utf-8")
+        (out_dir / "compact.bin").write_bytes(pack_compact(compact))
+
+
+_HISTORY_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    version TEXT NOT NULL UNIQUE,
+    version_date TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_versions_date ON versions (version_date, seq);
+
+CREATE TABLE IF NOT EXISTS maps (
+    id INTEGER PRIMARY KEY,
+    name_zh TEXT NOT NULL UNIQUE,
+    name_en TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_maps_name_en ON maps (name_en);
+
+CREATE TABLE IF NOT EXISTS pool_membership (
+    version_id INTEGER NOT NULL REFERENCES versions (id),
+    map_id INTEGER NOT NULL REFERENCES maps (id),
+    position INTEGER NOT NULL,
+    PRIMARY KEY (version_id, map_id)
+);
+CREATE INDEX IF NOT EXISTS idx_pool_membership_map ON pool_membership (map_id, version_id);
+
+CREATE VIEW IF NOT EXISTS version_timeline AS
+SELECT
+    id,
+    version,
+    version_date,
+    LAG(id) OVER (ORDER BY version_date, seq) AS prev_id,
+    LEAD(version_date) OVER (ORDER BY version_date, seq) AS next_date
+FROM versions;
+
+CREATE VIEW IF NOT EXISTS time_in_pool AS
+SELECT
+    m.name_zh,
+    m.name_en,
+    COUNT(t.id) AS versions_in_pool,
+    MIN(t.version_date) AS first_date,
+    MAX(t.version_date) AS last_date,
+    CAST(
+        SUM(julianday(COALESCE(t.next_date, date('now'))) - julianday(t.version_date))
+        AS INTEGER
+    ) AS days_in_pool
+FROM maps m
+LEFT JOIN pool_membership pm ON pm.map_id = m.id
+LEFT JOIN version_timeline t ON t.id = pm.version_id
+GROUP BY m.id;
+
+CREATE VIEW IF NOT EXISTS rotation_events AS
+SELECT t.version, t.version_date, m.name_zh, m.name_en, 'in' AS event
+FROM version_timeline t
+JOIN pool_membership pm ON pm.version_id = t.id
+JOIN maps m ON m.id = pm.map_id
+WHERE t.prev_id IS NOT NULL
+  AND NOT EXISTS (
+    SELECT 1 FROM pool_membership p WHERE p.version_id = t.prev_id AND p.map_id = pm.map_id
+  )
+UNION ALL
+SELECT t.version, t.version_date, m.name_zh, m.name_en, 'out' AS event
+FROM version_timeline t
+JOIN pool_membership pm ON pm.version_id = t.prev_id
+JOIN maps m ON m.id = pm.map_id
+WHERE NOT EXISTS (
+    SELECT 1 FROM pool_membership p WHERE p.version_id = t.id AND p.map_id = pm.map_id
+);
+"""
+
+
+def _upsert_db_version(conn, entry, seq, map_ids):
+    row = conn.execute("SELECT id FROM versions WHERE version = ?", (entry["version"],)).fetchone()
+    if row:
+        version_id = row[0]
+        conn.execute(
+            "UPDATE versions SET version_date = ?, seq = ? WHERE id = ?",
+            (entry["version_date"], seq, version_id),
+        )
+        conn.execute("DELETE FROM pool_membership WHERE version_id = ?", (version_id,))
+    else:
+        version_id = conn.execute(
+            "INSERT INTO versions (version, version_date, seq) VALUES (?, ?, ?)",
+            (entry["version"], entry["version_date"], seq),
+        ).lastrowid
+    for position, name_zh in enumerate(entry["current_pool"]):
+        if name_zh not in map_ids:
+            map_ids[name_zh] = conn.execute(
+                "INSERT INTO maps (name_zh, name_en) VALUES (?, '')", (name_zh,)
+            ).lastrowid
+        conn.execute(
+            "INSERT INTO pool_membership (version_id, map_id, position) VALUES (?, ?, ?)",
+            (version_id, map_ids[name_zh], position),
+        )
+
+
+def _db_history(conn):
+    stored = {
+        version: (version_date, seq, [])
+        for version, version_date, seq in conn.execute(
+            "SELECT version, version_date, seq FROM versions"
+        )
+    }
+    rows = conn.execute(
+        "SELECT v.version, m.name_zh FROM pool_membership pm "
+        "JOIN versions v ON v.id = pm.version_id "
+        "JOIN maps m ON m.id = pm.map_id "
+        "ORDER BY pm.version_id, pm.position"
+    )
+    for version, name_zh in rows:
+        stored[version][2].append(name_zh)
+    return stored
+
+
+def update_history_db(path, map_map, entries):
+    import sqlite3
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                conn.executescript(_HISTORY_DB_SCHEMA)
+                conn.executemany(
+                    "INSERT INTO maps (name_zh, name_en) VALUES (?, ?) "
+                    "ON CONFLICT (name_zh) DO UPDATE SET name_en = excluded.name_en",
+                    list(map_map.items()),
+                )
+                map_ids = dict(conn.execute("SELECT name_zh, id FROM maps"))
+                # Sync against the whole history so versions written without
+                # the DB are picked up; only differing rows are rewritten.
+                stored = _db_history(conn)
+                for seq, entry in enumerate(entries, start=1):
+                    wanted = (entry["version_date"], seq, list(entry["current_pool"]))
+                    if stored.pop(entry["version"], None) != wanted:
+                        _upsert_db_version(conn, entry, seq, map_ids)
+                for version in stored:
+                    conn.execute(
+                        "DELETE FROM pool_membership WHERE version_id = "
+                        "(SELECT id FROM versions WHERE version = ?)",
+                        (version,),
+                    )
+                    conn.execute("DELETE FROM versions WHERE version = ?", (version,))
+        finally:
+            conn.close()
+    except sqlite3.Error as exc:
+        raise ValueError(f"history db error: {exc}") from exc
+
+
+def _membership_record(index, name_zh, map_map):
+    record = index["maps"].get(name_zh)
+    if record is None:
+        record = {
+            "name_zh": name_zh,
+            "name_en": map_map.get(name_zh, ""),
+            "in_pool": False,
+            "intervals": [],
+        }
+        index["maps"][name_zh] = record
+    return record
+
+
+def _revert_membership_version(index, version):
+    reverted = set()
+    for name_zh, record in index["maps"].items():
+        intervals = record["intervals"]
+        if intervals and intervals[-1]["start_version"] == version:
+            intervals.pop()
+            reverted.add(name_zh)
+        elif intervals and intervals[-1]["end_version"] == version:
+            intervals[-1]["end_version"] = None
+            intervals[-1]["end_date"] = None
+            reverted.add(name_zh)
+        record["in_pool"] = bool(intervals) and intervals[-1]["end_version"] is None
+    return reverted
+
+
+def update_membership_index(index, map_map, current_pool, version, version_date):
+    changed = set()
+    for name_zh, name_en in map_map.items():
+        record = index["maps"].get(name_zh)
+        if record is None or record["name_en"] != name_en:
+            _membership_record(index, name_zh, map_map)["name_en"] = name_en
+            changed.add(name_zh)
+
+    if index.get("version") == version:
+        # Re-applying the latest version: undo it so the diff starts from the
+        # pool it was originally applied to.
+        changed |= _revert_membership_version(index, version)
+    previous = {m for m, record in index["maps"].items() if record["in_pool"]}
+    current = set(current_pool)
+
+    for name_zh in normalize_list(current_pool):
+        record = _membership_record(index, name_zh, map_map)
+        if not record["in_pool"]:
+            record["intervals"].append({
+                "start_version": version,
+                "start_date": version_date,
+                "end_version": None,
+                "end_date": None,
+            })
+            record["in_pool"] = True
+            changed.add(name_zh)
+    for name_zh in previous - current:
+        record = index["maps"][name_zh]
+        record["intervals"][-1]["end_version"] = version
+        record["intervals"][-1]["end_date"] = version_date
+        record["in_pool"] = False
+        changed.add(name_zh)
+
+    index["version"] = version
+    index["version_date"] = version_date
+    return changed
+
+
+def membership_index_is_current(index, entries, version):
+    # The incremental path is only valid when the built version is the last
+    # entry and the index stops exactly one entry before it (or at it).
+    if index is None or not entries or entries[-1]["version"] != version:
+        return False
+    if index.get("version") == version:
+        return True
+    return len(entries) > 1 and index.get("version") == entries[-2]["version"]
+
+
+def build_membership_index(entries, map_map):
+    index = {"version": "", "version_date": "", "maps": {}}
+    for entry in entries:
+        update_membership_index(
+            index,
+            map_map,
+            entry["current_pool"],
+            entry["version"],
+            entry["version_date"],
+        )
+    return index
+
+
+def load_membership_index(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_membership_index(path, index):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_text_atomic(path, json.dumps(index, ensure_ascii=False, indent=2))
+
+
+def write_map_index_outputs(dist_dir, index, changed):
+    maps_dir = Path(dist_dir) / "maps"
+    maps_dir.mkdir(parents=True, exist_ok=True)
+    combined = {
+        "version": index["version"],
+        "version_date": index["version_date"],
+        "maps": {},
+    }
+    for name_zh, record in index["maps"].items():
+        name_en = record["name_en"] or name_zh
+        combined["maps"][name_en] = record
+        map_path = maps_dir / f"{name_en}.json"
+        if name_zh in changed or not map_path.exists():
+            map_path.write_text(
+                json.dumps(record, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
+    published = {f"{name_en}.json" for name_en in combined["maps"]} | {"index.json"}
+    for map_path in maps_dir.glob("*.json"):
+        if map_path.name not in published:
+            map_path.unlink()
+    (maps_dir / "index.json").write_text(
+        json.dumps(combined, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+
+
 def _col_to_index(cell_ref):
     letters = ""
     for ch in cell_ref:
@@ -230,6 +848,10 @@ def _col_to_index(cell_ref):
 
 
 def read_current_pool_from_excel(path):
+    # Only --bootstrap reads Excel; keep these imports off the CLI start path.
+    import xml.etree.ElementTree as ET
+    import zipfile
+
     ns = {"main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
     with zipfile.ZipFile(path) as z:
         shared_strings = []
@@ -0,0 +1,88 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+try:
+    from scripts import map_pool
+except ModuleNotFoundError:
+    import map_pool
+
+
+def run(
+    config_dir,
+    out_count,
+    return_count=None,
+    history_path="history/versions.json",
+    max_size=7,
+    keep="",
+    exclude="",
+    top=None,
+):
+    config_dir = Path(config_dir)
+    map_map = map_pool.load_map_name_map(config_dir / "map-name-map.json")
+    base_pool = map_pool.load_current_pool(config_dir / "current_pool.json")
+    entries = map_pool.load_history(history_path)
+
+    candidates = map_pool.simulate_rotations(
+        base_pool,
+        map_map,
+        entries,
+        out_count,
+        return_count=return_count,
+        max_size=max_size,
+        keep=map_pool.normalize_list(map_pool.parse_list(keep)),
+        exclude=map_pool.normalize_list(map_pool.parse_list(exclude)),
+        top=top,
+    )
+    return {
+        "base_pool": base_pool,
+        "history_version": entries[-1]["version"] if entries else "",
+        "candidates": [
+            {
+                "rank": rank,
+                **candidate,
+                "maps": map_pool.build_maps(
+                    candidate["current_pool"],
+                    candidate["returning"],
+                    [],
+                    candidate["rotated_out"],
+                    map_map,
+                ),
+            }
+            for rank, candidate in enumerate(candidates, start=1)
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config-dir", default="config")
+    parser.add_argument("--history-path", default="history/versions.json")
+    parser.add_argument("--out-count", type=int, default=1)
+    parser.add_argument("--return-count", type=int, default=None)
+    parser.add_argument("--max-size", type=int, default=7)
+    parser.add_argument("--keep", default="")
+    parser.add_argument("--exclude", default="")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    try:
+        report = run(
+            config_dir=args.config_dir,
+            out_count=args.out_count,
+            return_count=args.return_count,
+            history_path=args.history_path,
+            max_size=args.max_size,
+            keep=args.keep,
+            exclude=args.exclude,
+            top=args.top,
+        )
+    except ValueError as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
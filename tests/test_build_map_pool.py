@@ -1,12 +1,14 @@
 import json
 import os
+import sqlite3
 import subprocess
 import sys
 import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
 
-from scripts import build_map_pool
+from scripts import build_map_pool, map_pool, simulate_rotations
 
 
 class TestBuildScript(unittest.TestCase):
@@ -194,6 +196,418 @@ class TestBuildScript(unittest.TestCase):
             self.assertEqual(updated[0]["current_pool"], ["A"])
 
 
+class TestCompactBuild(unittest.TestCase):
+    def test_compact_failure_leaves_config_and_history(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            history = root / "history.json"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A", "B": "B"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A", "B"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            old_history = [{"version": "v0.00", "version_date": "2026-01-01", "current_pool": ["X"]}]
+            history.write_text(json.dumps(old_history), encoding="utf-8")
+            env = {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+            with self.assertRaises(ValueError):
+                build_map_pool.run(
+                    config,
+                    root / "dist",
+                    env,
+                    bootstrap=False,
+                    excel_path=None,
+                    history_path=history,
+                    compact=True,
+                )
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A", "B"])
+            self.assertEqual(json.loads(history.read_text(encoding="utf-8")), old_history)
+
+
+class TestConcurrentBuilds(unittest.TestCase):
+    def _setup(self, root, pool):
+        config = root / "config"
+        config.mkdir()
+        (config / "map-name-map.json").write_text(
+            json.dumps({"A": "A", "B": "B", "C": "C", "D": "D"}, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        (config / "current_pool.json").write_text(
+            json.dumps(pool, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        return config
+
+    def _run_with_concurrent_pool(self, root, config, concurrent_pool, env, **kwargs):
+        compute_build = build_map_pool.compute_build
+        calls = []
+
+        def racing_compute_build(*args):
+            if not calls:
+                (config / "current_pool.json").write_text(
+                    json.dumps(concurrent_pool, ensure_ascii=False),
+                    encoding="utf-8",
+                )
+            calls.append(args)
+            return compute_build(*args)
+
+        with mock.patch.object(build_map_pool, "compute_build", racing_compute_build):
+            build_map_pool.run(
+                config,
+                root / "dist",
+                env,
+                bootstrap=False,
+                excel_path=None,
+                history_path=root / "history.json",
+                **kwargs,
+            )
+        return calls
+
+    def test_run_rebases_changeset_onto_new_pool(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = self._setup(root, ["A", "B"])
+            env = {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+            calls = self._run_with_concurrent_pool(root, config, ["A", "B", "C"], env)
+            self.assertEqual(len(calls), 2)
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A", "C"])
+
+    def test_run_fails_when_changeset_no_longer_applies(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = self._setup(root, ["A", "B"])
+            env = {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+            with self.assertRaises(ValueError):
+                self._run_with_concurrent_pool(root, config, ["A", "C"], env)
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A", "C"])
+            self.assertFalse((root / "history.json").exists())
+
+    def test_run_fails_on_conflict_when_requested(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = self._setup(root, ["A", "B"])
+            env = {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+            with self.assertRaises(ValueError):
+                self._run_with_concurrent_pool(
+                    root, config, ["A", "B", "C"], env, on_conflict="fail"
+                )
+
+    def test_run_detects_pool_change_right_after_load(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = self._setup(root, ["A", "B"])
+            file_digest = map_pool.file_digest
+            calls = []
+
+            def racing_file_digest(path):
+                if not calls:
+                    (config / "current_pool.json").write_text(
+                        json.dumps(["A", "B", "C"], ensure_ascii=False),
+                        encoding="utf-8",
+                    )
+                calls.append(path)
+                return file_digest(path)
+
+            env = {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+            with mock.patch.object(map_pool, "file_digest", racing_file_digest):
+                build_map_pool.run(
+                    config,
+                    root / "dist",
+                    env,
+                    bootstrap=False,
+                    excel_path=None,
+                    history_path=root / "history.json",
+                )
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A", "C"])
+
+    def test_dry_run_leaves_config_and_history(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = self._setup(root, ["A", "B"])
+            env = {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+            build_map_pool.run(
+                config,
+                root / "dist",
+                env,
+                bootstrap=False,
+                excel_path=None,
+                history_path=root / "history.json",
+                dry_run=True,
+            )
+            meta = json.loads((root / "dist" / "meta.json").read_text(encoding="utf-8"))
+            self.assertEqual(meta["current_pool"], ["A"])
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A", "B"])
+            self.assertFalse((root / "history.json").exists())
+
+
+class TestMapIndexBuild(unittest.TestCase):
+    def test_stale_map_index_is_rebuilt_from_history(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            history = root / "history.json"
+            map_index = root / "map_index.json"
+            config.mkdir()
+            map_map = {"A": "A", "B": "B", "C": "C"}
+            (config / "map-name-map.json").write_text(json.dumps(map_map), encoding="utf-8")
+            (config / "current_pool.json").write_text(json.dumps(["A", "B"]), encoding="utf-8")
+            builds = [
+                ({"ROTATED_OUT": "B", "RETURNING": "C"}, map_index),
+                ({"ROTATED_OUT": "A", "RETURNING": "B"}, None),
+                ({"ROTATED_OUT": "C", "RETURNING": "A"}, map_index),
+            ]
+            for i, (changes, index_path) in enumerate(builds):
+                env = {"VERSION": f"v1.0{i}", "VERSION_DATE": f"2026-0{i + 1}-01", **changes}
+                build_map_pool.run(
+                    config,
+                    root / "dist",
+                    env,
+                    bootstrap=False,
+                    excel_path=None,
+                    history_path=history,
+                    map_index_path=index_path,
+                )
+            entries = json.loads(history.read_text(encoding="utf-8"))
+            got = json.loads(map_index.read_text(encoding="utf-8"))
+            self.assertEqual(got, map_pool.build_membership_index(entries, map_map))
+            self.assertFalse(got["maps"]["C"]["in_pool"])
+            self.assertEqual(got["maps"]["B"]["intervals"][-1]["start_version"], "v1.01")
+
+
+class TestWatch(unittest.TestCase):
+    def test_watch_rebuilds_on_changeset_change(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            dist = root / "dist"
+            history = root / "history.json"
+            changeset = root / "changeset.json"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A", "B": "B", "C": "C"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A", "B"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            changeset.write_text(
+                json.dumps(
+                    {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+                ),
+                encoding="utf-8",
+            )
+            logs = []
+            edits = [
+                {
+                    "ROTATED_OUT": "A",
+                    "RETURNING": "C",
+                    "VERSION": "v1.00",
+                    "VERSION_DATE": "2026-02-04",
+                }
+            ]
+
+            def edit_changeset(_interval):
+                if edits:
+                    changeset.write_text(json.dumps(edits.pop()), encoding="utf-8")
+
+            build_map_pool.watch(
+                config,
+                dist,
+                {},
+                changeset_path=changeset,
+                history_path=history,
+                max_cycles=3,
+                sleep=edit_changeset,
+                log=logs.append,
+            )
+
+            self.assertEqual(len(logs), 2)
+            self.assertTrue(all(line.startswith("rebuilt v1.00") for line in logs))
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["B", "C"])
+            meta = json.loads((dist / "meta.json").read_text(encoding="utf-8"))
+            self.assertEqual(meta["previous_pool"], ["A", "B"])
+            updated = json.loads(history.read_text(encoding="utf-8"))
+            self.assertEqual(len(updated), 1)
+            self.assertEqual(updated[0]["current_pool"], ["B", "C"])
+
+    def test_watch_logs_errors_and_keeps_running(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            logs = []
+            build_map_pool.watch(
+                config,
+                root / "dist",
+                {"ROTATED_OUT": "X"},
+                history_path=root / "history.json",
+                max_cycles=2,
+                sleep=lambda _interval: None,
+                log=logs.append,
+            )
+            self.assertEqual(len(logs), 1)
+            self.assertTrue(logs[0].startswith("ERROR:"))
+
+    def test_watch_logs_missing_pool_and_refreshes_names_only(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            history = root / "history.json"
+            config.mkdir()
+            map_path = config / "map-name-map.json"
+            map_path.write_text(json.dumps({"A": "A", "B": "B"}), encoding="utf-8")
+            logs = []
+            build_map_pool.watch(
+                config,
+                root / "dist",
+                {"VERSION": "v1.00", "VERSION_DATE": "2026-02-04"},
+                history_path=history,
+                max_cycles=1,
+                log=logs.append,
+            )
+            self.assertEqual(len(logs), 1)
+            self.assertTrue(logs[0].startswith("ERROR:"))
+
+            (config / "current_pool.json").write_text(json.dumps(["A"]), encoding="utf-8")
+            edits = [{"A": "Ascent", "B": "B"}]
+
+            def rename_map(_interval):
+                if edits:
+                    map_path.write_text(json.dumps(edits.pop()), encoding="utf-8")
+
+            logs = []
+            history_db = root / "history.sqlite"
+            map_index = root / "map_index.json"
+            build_map_pool.watch(
+                config,
+                root / "dist",
+                {"VERSION": "v1.00", "VERSION_DATE": "2026-02-04"},
+                history_path=history,
+                history_db_path=history_db,
+                map_index_path=map_index,
+                max_cycles=3,
+                sleep=rename_map,
+                log=logs.append,
+            )
+            self.assertEqual(len(logs), 2)
+            self.assertIn("(all stages)", logs[0])
+            self.assertIn("(dist and map names)", logs[1])
+            maps = json.loads((root / "dist" / "maps.json").read_text(encoding="utf-8"))
+            self.assertEqual(maps["maps"][0]["name_en"], "Ascent")
+            index = json.loads(map_index.read_text(encoding="utf-8"))
+            self.assertEqual(index["maps"]["A"]["name_en"], "Ascent")
+            conn = sqlite3.connect(history_db)
+            try:
+                name_en = conn.execute("SELECT name_en FROM maps WHERE name_zh = 'A'").fetchone()
+            finally:
+                conn.close()
+            self.assertEqual(name_en, ("Ascent",))
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A"])
+
+    def test_watch_dry_run_leaves_config_and_history(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            history = root / "history.json"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A", "B": "B"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A", "B"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            logs = []
+            build_map_pool.watch(
+                config,
+                root / "dist",
+                {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"},
+                history_path=history,
+                dry_run=True,
+                max_cycles=1,
+                log=logs.append,
+            )
+            self.assertEqual(len(logs), 1)
+            self.assertIn("(dist only)", logs[0])
+            meta = json.loads((root / "dist" / "meta.json").read_text(encoding="utf-8"))
+            self.assertEqual(meta["current_pool"], ["A"])
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A", "B"])
+            self.assertFalse(history.exists())
+
+    def test_cli_rejects_watch_with_on_conflict_fail(self):
+        result = subprocess.run(
+            [sys.executable, "scripts/build_map_pool.py", "--watch", "--on-conflict", "fail"],
+            capture_output=True,
+            text=True,
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("ERROR:", result.stderr)
+
+    def test_watch_reloads_pool_changed_before_lock(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A", "B": "B", "C": "C"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A", "B"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            compute_build = build_map_pool.compute_build
+            calls = []
+
+            def racing_compute_build(*args):
+                if not calls:
+                    (config / "current_pool.json").write_text(
+                        json.dumps(["A", "B", "C"], ensure_ascii=False),
+                        encoding="utf-8",
+                    )
+                calls.append(args)
+                return compute_build(*args)
+
+            logs = []
+            with mock.patch.object(build_map_pool, "compute_build", racing_compute_build):
+                build_map_pool.watch(
+                    config,
+                    root / "dist",
+                    {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"},
+                    history_path=root / "history.json",
+                    max_cycles=3,
+                    sleep=lambda _interval: None,
+                    log=logs.append,
+                )
+            self.assertEqual(len(logs), 2)
+            self.assertTrue(logs[0].startswith("ERROR: current_pool.json changed"))
+            self.assertTrue(logs[1].startswith("rebuilt v1.00"))
+            current = json.loads((config / "current_pool.json").read_text(encoding="utf-8"))
+            self.assertEqual(current, ["A", "C"])
+
+
 class TestCli(unittest.TestCase):
     def test_cli_logs_error_without_traceback(self):
         with tempfile.TemporaryDirectory() as td:
@@ -237,6 +651,127 @@ class TestCli(unittest.TestCase):
             self.assertNotIn("Traceback", result.stderr)
 
 
+class TestSimulateRotationsScript(unittest.TestCase):
+    def test_run_builds_ranked_report(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            history = root / "history.json"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A", "B": "B", "C": "C", "D": "D"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A", "B"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            history.write_text(
+                json.dumps(
+                    [
+                        {"version": "v1.00", "version_date": "2026-01-01", "current_pool": ["A", "C"]},
+                        {"version": "v1.04", "version_date": "2026-02-01", "current_pool": ["A", "B"]},
+                    ],
+                    ensure_ascii=False,
+                ),
+                encoding="utf-8",
+            )
+            report = simulate_rotations.run(
+                config, out_count=1, history_path=history, keep="B", top=5
+            )
+            self.assertEqual(report["base_pool"], ["A", "B"])
+            self.assertEqual(report["history_version"], "v1.04")
+            self.assertEqual([c["rank"] for c in report["candidates"]], [1, 2])
+            best = report["candidates"][0]
+            self.assertEqual(best["rotated_out"], ["A"])
+            self.assertEqual(best["returning"], ["D"])
+            self.assertEqual(best["current_pool"], ["B", "D"])
+            status = {m["name_zh"]: m["status"] for m in best["maps"]}
+            self.assertEqual(status, {"B": "in_pool", "D": "returning", "A": "rotated_out"})
+
+    def test_cli_prints_report_and_logs_errors(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A", "B": "B"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            base_cmd = [
+                sys.executable,
+                "scripts/simulate_rotations.py",
+                "--config-dir",
+                str(config),
+                "--history-path",
+                str(root / "history.json"),
+            ]
+            result = subprocess.run(base_cmd, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0)
+            report = json.loads(result.stdout)
+            self.assertEqual(report["history_version"], "")
+            self.assertEqual(report["candidates"][0]["current_pool"], ["B"])
+
+            result = subprocess.run(
+                base_cmd + ["--keep", "X"], capture_output=True, text=True
+            )
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("ERROR:", result.stderr)
+            self.assertNotIn("Traceback", result.stderr)
+
+
+class TestStartup(unittest.TestCase):
+    def test_cli_import_skips_excel_and_sqlite_modules(self):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from scripts import build_map_pool; "
+                "print(sorted(m for m in ('zipfile', 'sqlite3', 'xml.etree.ElementTree') "
+                "if m in sys.modules))",
+            ],
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_run_reports_snapshot_timings(self):
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            config = root / "config"
+            config.mkdir()
+            (config / "map-name-map.json").write_text(
+                json.dumps({"A": "A", "B": "B"}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            (config / "current_pool.json").write_text(
+                json.dumps(["A", "B"], ensure_ascii=False),
+                encoding="utf-8",
+            )
+            env = {"ROTATED_OUT": "B", "VERSION": "v1.00", "VERSION_DATE": "2026-02-04"}
+            results = []
+            for _ in range(2):
+                timings = {}
+                build_map_pool.run(
+                    config,
+                    root / "dist",
+                    env,
+                    bootstrap=False,
+                    excel_path=None,
+                    history_path=root / "history.json",
+                    dry_run=True,
+                    snapshot_path=root / "snapshot.bin",
+                    timings=timings,
+                )
+                results.append(timings["snapshot"])
+            self.assertEqual(results, ["miss", "hit"])
+            self.assertIn("config_ms", timings)
+
+
 class TestConfigFiles(unittest.TestCase):
     def test_config_files_exist(self):
         self.assertTrue(Path("config/map-name-map.json").exists())
@@ -1,4 +1,6 @@
 import json
+import marshal
+import sqlite3
 import tempfile
 import unittest
 from pathlib import Path
@@ -134,6 +136,294 @@ class TestIO(unittest.TestCase):
             self.assertTrue((p / "v1.00" / "meta.json").exists())
 
 
+class TestSimulateRotations(unittest.TestCase):
+    def test_pool_mask_round_trip(self):
+        bits = map_pool.build_map_bits({"A": "A", "B": "B", "C": "C"})
+        mask = map_pool.pool_to_mask(["C", "A"], bits)
+        self.assertEqual(mask, 0b101)
+        self.assertEqual(map_pool.mask_to_pool(mask, bits), ["A", "C"])
+        with self.assertRaises(ValueError):
+            map_pool.pool_to_mask(["X"], bits)
+
+    def test_simulate_rotations_ranks_by_history(self):
+        map_map = {"A": "A", "B": "B", "C": "C", "D": "D", "E": "E"}
+        entries = [
+            {"version": "v1", "version_date": "2026-01-01", "current_pool": ["A", "B", "D"]},
+            {"version": "v2", "version_date": "2026-02-01", "current_pool": ["A", "B", "C"]},
+        ]
+        got = map_pool.simulate_rotations(["A", "B", "C"], map_map, entries, out_count=1)
+        self.assertEqual(len(got), 6)
+        self.assertEqual(got[0]["rotated_out"], ["A"])
+        self.assertEqual(got[0]["returning"], ["E"])
+        self.assertEqual(got[0]["score"], 4)
+        for candidate in got:
+            map_pool.validate_pool_size(candidate["current_pool"])
+            self.assertEqual(
+                map_pool.build_warnings(
+                    ["A", "B", "C"], candidate["returning"], [], candidate["rotated_out"]
+                ),
+                [],
+            )
+
+    def test_simulate_rotations_prunes(self):
+        map_map = {"A": "A", "B": "B", "C": "C", "D": "D"}
+        got = map_pool.simulate_rotations(
+            ["A", "B"], map_map, [], out_count=1, keep=["A"], exclude=["C"], top=5
+        )
+        self.assertEqual(
+            [(c["rotated_out"], c["returning"]) for c in got], [(["B"], ["D"])]
+        )
+        self.assertEqual(
+            map_pool.simulate_rotations(["A", "B"], map_map, [], 0, 2, max_size=3), []
+        )
+
+    def test_simulate_rotations_unknown_map(self):
+        with self.assertRaises(ValueError):
+            map_pool.simulate_rotations(["A"], {"A": "A"}, [], 1, keep=["X"])
+
+
+class TestCompactFormat(unittest.TestCase):
+    def setUp(self):
+        self.map_map = {"亚海悬城": "Ascent", "霓虹町": "Split", "微风岛屿": "Breeze"}
+        self.maps_payload = {
+            "maps": [
+                {"name_zh": "霓虹町", "name_en": "Split", "status": "in_pool"},
+                {"name_zh": "微风岛屿", "name_en": "Breeze", "status": "returning"},
+                {"name_zh": "亚海悬城", "name_en": "Ascent", "status": "rotated_out"},
+            ]
+        }
+        self.entries = [
+            {"version": "v1.00", "version_date": "2026-01-01", "current_pool": ["亚海悬城", "霓虹町"]},
+            {"version": "v1.04", "version_date": "2026-02-04", "current_pool": ["霓虹町", "微风岛屿"]},
+        ]
+
+    def test_compact_json_round_trip(self):
+        compact = map_pool.encode_compact(
+            self.map_map, self.maps_payload, self.entries, "v1.04", "2026-02-04"
+        )
+        self.assertEqual(compact["maps"], [[1, 0], [2, 1], [0, 3]])
+        self.assertEqual(compact["history"][0], ["v1.00", "2026-01-01", 0b011])
+        raw = map_pool.dumps_compact_json(compact)
+        got = map_pool.decode_compact(json.loads(raw))
+        self.assertEqual(got["maps"], self.maps_payload["maps"])
+        self.assertEqual(got["history"], self.entries)
+        self.assertEqual(got["version_date"], "2026-02-04")
+
+    def test_compact_binary_round_trip(self):
+        compact = map_pool.encode_compact(
+            self.map_map, self.maps_payload, self.entries, "v1.04", "2026-02-04"
+        )
+        data = map_pool.pack_compact(compact)
+        self.assertEqual(map_pool.unpack_compact(data), compact)
+        with self.assertRaises(ValueError):
+            map_pool.unpack_compact(b"XXX" + data[3:])
+
+    def test_write_compact_outputs(self):
+        compact = map_pool.encode_compact(self.map_map, self.maps_payload, self.entries)
+        with tempfile.TemporaryDirectory() as td:
+            p = Path(td)
+            map_pool.write_compact_outputs(p, compact, version="v1.04")
+            self.assertTrue((p / "compact.json").exists())
+            self.assertTrue((p / "v1.04" / "compact.bin").exists())
+
+
+class TestHistoryDb(unittest.TestCase):
+    def test_update_history_db_seeds_then_upserts(self):
+        map_map = {"A": "A", "B": "B", "C": "C"}
+        entries = [
+            {"version": "v1.00", "version_date": "2026-01-01", "current_pool": ["A", "B"]},
+            {"version": "v1.04", "version_date": "2026-02-01", "current_pool": ["A", "C"]},
+        ]
+        with tempfile.TemporaryDirectory() as td:
+            db = Path(td) / "history.sqlite"
+            map_pool.update_history_db(db, map_map, entries)
+            entries[1] = {"version": "v1.04", "version_date": "2026-02-04", "current_pool": ["B", "C"]}
+            map_pool.update_history_db(db, map_map, entries)
+            conn = sqlite3.connect(db)
+            try:
+                versions = conn.execute(
+                    "SELECT version, version_date FROM versions ORDER BY seq"
+                ).fetchall()
+                events = conn.execute(
+                    "SELECT version, name_zh, event FROM rotation_events ORDER BY event, name_zh"
+                ).fetchall()
+                in_pool = dict(
+                    conn.execute("SELECT name_zh, versions_in_pool FROM time_in_pool").fetchall()
+                )
+            finally:
+                conn.close()
+            self.assertEqual(versions, [("v1.00", "2026-01-01"), ("v1.04", "2026-02-04")])
+            self.assertEqual(events, [("v1.04", "C", "in"), ("v1.04", "A", "out")])
+            self.assertEqual(in_pool, {"A": 1, "B": 2, "C": 1})
+
+    def test_update_history_db_picks_up_versions_written_without_db(self):
+        map_map = {"A": "A", "B": "B", "C": "C"}
+        entries = [
+            {"version": "v1.00", "version_date": "2026-01-01", "current_pool": ["A", "B"]},
+        ]
+        with tempfile.TemporaryDirectory() as td:
+            db = Path(td) / "history.sqlite"
+            map_pool.update_history_db(db, map_map, entries)
+            entries += [
+                {"version": "v1.04", "version_date": "2026-02-01", "current_pool": ["A", "C"]},
+                {"version": "v1.08", "version_date": "2026-03-01", "current_pool": ["B", "C"]},
+            ]
+            map_pool.update_history_db(db, map_map, entries)
+            conn = sqlite3.connect(db)
+            try:
+                versions = [
+                    row[0] for row in conn.execute("SELECT version FROM versions ORDER BY seq")
+                ]
+                events = conn.execute(
+                    "SELECT version, name_zh, event FROM rotation_events "
+                    "ORDER BY version, event, name_zh"
+                ).fetchall()
+            finally:
+                conn.close()
+            self.assertEqual(versions, ["v1.00", "v1.04", "v1.08"])
+            self.assertEqual(
+                events,
+                [
+                    ("v1.04", "C", "in"),
+                    ("v1.04", "B", "out"),
+                    ("v1.08", "B", "in"),
+                    ("v1.08", "A", "out"),
+                ],
+            )
+
+    def test_update_history_db_reports_db_errors(self):
+        with tempfile.TemporaryDirectory() as td:
+            with self.assertRaises(ValueError):
+                map_pool.update_history_db(Path(td), {"A": "A"}, [])
+
+
+class TestMembershipIndex(unittest.TestCase):
+    def setUp(self):
+        self.map_map = {"A": "Ascent", "B": "Bind", "C": "Corrode"}
+        self.entries = [
+            {"version": "v1.00", "version_date": "2026-01-01", "current_pool": ["A", "B"]},
+            {"version": "v1.04", "version_date": "2026-02-01", "current_pool": ["A", "C"]},
+        ]
+
+    def test_build_membership_index_intervals(self):
+        index = map_pool.build_membership_index(self.entries, self.map_map)
+        self.assertEqual(index["version"], "v1.04")
+        self.assertEqual(
+            index["maps"]["B"]["intervals"],
+            [
+                {
+                    "start_version": "v1.00",
+                    "start_date": "2026-01-01",
+                    "end_version": "v1.04",
+                    "end_date": "2026-02-01",
+                }
+            ],
+        )
+        self.assertTrue(index["maps"]["A"]["in_pool"])
+        self.assertFalse(index["maps"]["B"]["in_pool"])
+
+    def test_update_membership_index_is_incremental(self):
+        index = map_pool.build_membership_index(self.entries, self.map_map)
+        changed = map_pool.update_membership_index(
+            index, self.map_map, ["A", "B"], "v1.08", "2026-03-01"
+        )
+        self.assertEqual(changed, {"B", "C"})
+        self.assertEqual(len(index["maps"]["B"]["intervals"]), 2)
+
+        changed = map_pool.update_membership_index(
+            index, self.map_map, ["B", "C"], "v1.08", "2026-03-01"
+        )
+        self.assertEqual(changed, {"A", "B", "C"})
+        expected = map_pool.build_membership_index(
+            self.entries
+            + [{"version": "v1.08", "version_date": "2026-03-01", "current_pool": ["B", "C"]}],
+            self.map_map,
+        )
+        self.assertEqual(index, expected)
+
+    def test_membership_index_is_current(self):
+        index = map_pool.build_membership_index(self.entries[:1], self.map_map)
+        later = self.entries + [
+            {"version": "v1.08", "version_date": "2026-03-01", "current_pool": ["B", "C"]}
+        ]
+        self.assertTrue(map_pool.membership_index_is_current(index, self.entries, "v1.04"))
+        self.assertFalse(map_pool.membership_index_is_current(index, later, "v1.08"))
+        self.assertFalse(map_pool.membership_index_is_current(index, self.entries, "v1.00"))
+        self.assertFalse(map_pool.membership_index_is_current(None, self.entries, "v1.04"))
+
+    def test_update_membership_index_refreshes_name_en(self):
+        index = map_pool.build_membership_index(self.entries, self.map_map)
+        renamed = {**self.map_map, "C": "Breeze"}
+        changed = map_pool.update_membership_index(
+            index, renamed, ["A", "C"], "v1.04", "2026-02-01"
+        )
+        self.assertIn("C", changed)
+        self.assertEqual(index["maps"]["C"]["name_en"], "Breeze")
+        with tempfile.TemporaryDirectory() as td:
+            p = Path(td)
+            map_pool.write_map_index_outputs(
+                p, map_pool.build_membership_index(self.entries, self.map_map), set()
+            )
+            map_pool.write_map_index_outputs(p, index, changed)
+            self.assertTrue((p / "maps" / "Breeze.json").exists())
+            self.assertFalse((p / "maps" / "Corrode.json").exists())
+
+    def test_write_map_index_outputs(self):
+        index = map_pool.build_membership_index(self.entries, self.map_map)
+        with tempfile.TemporaryDirectory() as td:
+            p = Path(td)
+            map_pool.write_map_index_outputs(p, index, {"A"})
+            record = json.loads((p / "maps" / "Bind.json").read_text(encoding="utf-8"))
+            self.assertEqual(record["name_zh"], "B")
+            combined = json.loads((p / "maps" / "index.json").read_text(encoding="utf-8"))
+            self.assertEqual(sorted(combined["maps"]), ["Ascent", "Bind", "Corrode"])
+
+
+class TestJsonSnapshot(unittest.TestCase):
+    def test_load_json_snapshot_hit_and_invalidate(self):
+        with tempfile.TemporaryDirectory() as td:
+            p = Path(td)
+            pool_path = p / "current_pool.json"
+            snapshot = p / "cache" / "snapshot.bin"
+            map_pool.write_current_pool(pool_path, ["A"])
+            sources = {"base_pool": pool_path, "entries": p / "missing.json"}
+            defaults = {"entries": []}
+
+            values, digests, hit = map_pool.load_json_snapshot(snapshot, sources, defaults)
+            self.assertFalse(hit)
+            self.assertEqual(values, {"base_pool": ["A"], "entries": []})
+            self.assertEqual(digests["base_pool"], map_pool.file_digest(pool_path))
+            self.assertEqual(digests["entries"], "")
+
+            _, _, hit = map_pool.load_json_snapshot(snapshot, sources, defaults)
+            self.assertTrue(hit)
+
+            map_pool.write_current_pool(pool_path, ["A"])
+            _, _, hit = map_pool.load_json_snapshot(snapshot, sources, defaults)
+            self.assertTrue(hit)
+
+            map_pool.write_current_pool(pool_path, ["A", "B"])
+            values, _, hit = map_pool.load_json_snapshot(snapshot, sources, defaults)
+            self.assertFalse(hit)
+            self.assertEqual(values["base_pool"], ["A", "B"])
+
+    def test_load_json_snapshot_drops_other_sources(self):
+        with tempfile.TemporaryDirectory() as td:
+            p = Path(td)
+            snapshot = p / "snapshot.bin"
+            for name in ("a.json", "b.json"):
+                map_pool.write_current_pool(p / name, [name])
+                map_pool.load_json_snapshot(snapshot, {"base_pool": p / name})
+            cached = marshal.loads(snapshot.read_bytes())
+            self.assertEqual(list(cached), [str((p / "b.json").resolve())])
+
+    def test_load_json_snapshot_missing_required(self):
+        with tempfile.TemporaryDirectory() as td:
+            p = Path(td)
+            with self.assertRaises(FileNotFoundError):
+                map_pool.load_json_snapshot(p / "snapshot.bin", {"map_map": p / "missing.json"})
+
+
 class TestExcelBootstrap(unittest.TestCase):
     def test_read_pool_from_excel(self):
         got = map_pool.read_current_pool_from_excel("地图轮换.xlsx")